@@ -0,0 +1,485 @@
+from __future__ import annotations
+
+
+import argparse
+import datetime
+import functools
+import json
+from operator import attrgetter, itemgetter
+from pathlib import Path
+import re
+from typing import Iterable, Optional
+
+
+from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
+import matplotlib
+import numpy as np
+import pyperf
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+matplotlib.use("agg")
+
+
+from . import result
+
+
+@functools.lru_cache(maxsize=None)
+def get_data(result: result.Result) -> tuple[list[str], np.ndarray, np.ndarray]:
+    """
+    Get the benchmark data as a structure-of-arrays: the benchmark names, a
+    single contiguous array of all of the values, and the offset of each
+    benchmark's values within it (such that benchmark ``i`` owns
+    ``values[offsets[i]:offsets[i + 1]]``).
+    """
+    names = []
+    arrays = []
+
+    for benchmark in result.contents["benchmarks"]:
+        if "metadata" in benchmark:
+            name = benchmark["metadata"]["name"]
+        else:
+            name = result.contents["metadata"]["name"]
+        runs = [
+            np.asarray(run["values"], dtype=np.float64)
+            for run in benchmark["runs"]
+            if run.get("values")
+        ]
+        names.append(name)
+        arrays.append(np.concatenate(runs) if runs else np.empty(0, dtype=np.float64))
+
+    values = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.float64)
+    offsets = np.cumsum([0] + [len(x) for x in arrays], dtype=np.intp)
+
+    return names, values, offsets
+
+
+def remove_outliers(values, m=2):
+    # Compute the mean once and reuse it for the deviations, rather than
+    # making separate full passes for np.mean and np.std.
+    deviations = values - (values.sum() / values.size)
+    std = np.sqrt(np.square(deviations).sum() / values.size)
+    return values[np.abs(deviations) < m * std]
+
+
+def _lttb(values: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Downsample a series to ``n_out`` points using Largest Triangle Three
+    Buckets, which preserves the shape-defining points (including the
+    outliers in heavy tails) far better than a uniform stride.
+    """
+    n = len(values)
+    if n <= n_out:
+        return values
+
+    x = np.arange(n, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1, dtype=np.intp)
+    sampled = np.empty(n_out, dtype=np.float64)
+    sampled[0] = values[0]
+    sampled[-1] = values[-1]
+
+    a_x, a_y = 0.0, values[0]
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if start == end:
+            sampled[i + 1] = values[start]
+            a_x, a_y = x[start], values[start]
+            continue
+
+        # The third corner of each triangle is the average of the next bucket
+        next_end = edges[i + 2] if i + 2 < n_out - 1 else n
+        if end < next_end:
+            avg_x = x[end:next_end].mean()
+            avg_y = values[end:next_end].mean()
+        else:
+            avg_x, avg_y = x[-1], values[-1]
+
+        bucket_x = x[start:end]
+        bucket_y = values[start:end]
+        areas = np.abs(
+            (a_x - avg_x) * (bucket_y - a_y) - (a_x - bucket_x) * (avg_y - a_y)
+        )
+        best = np.argmax(areas)
+        sampled[i + 1] = bucket_y[best]
+        a_x, a_y = bucket_x[best], bucket_y[best]
+
+    return sampled
+
+
+def plot_diff_pair(ax, data):
+    all_data = []
+    violins = []
+
+    for i, (name, values, mean) in enumerate(data):
+        if values is not None:
+            violins.append(_lttb(values, 100))
+            all_data.extend(values)
+        else:
+            violins.append([1.0])
+            all_data.extend([1.0])
+            ax.text(1.01, i + 1, "insignificant")
+
+    violins.append(all_data)
+
+    violin = ax.violinplot(
+        violins,
+        vert=False,
+        showmeans=True,
+        showmedians=False,
+        widths=1.0,
+    )
+
+    # Compute the 10%/90% quantiles with a single numpy call per violin and
+    # draw them directly, rather than going through matplotlib's much slower
+    # per-violin quantile machinery.
+    quantiles = np.array([np.quantile(v, [0.1, 0.9]) for v in violins])
+    ys = np.repeat(np.arange(1, len(violins) + 1), 2)
+    ax.vlines(quantiles.ravel(), ys - 0.25, ys + 0.25, color="C0", linestyle=":")
+
+    # Rasterized violin bodies are blitted as a single image rather than
+    # rendered polygon-by-polygon, which dominates savefig time when there
+    # are many benchmarks.
+    for body in violin["bodies"]:
+        body.set_rasterized(True)
+
+    for i, values in enumerate(violins):
+        if not np.all(values == [1.0]):
+            mean = np.mean(values)
+            ax.text(mean, i + 1.3, f"{mean:.04f}", size=8)
+
+    return all_data
+
+
+def formatter(val, pos):
+    return f"{val:.02f}×"
+
+
+def _segment_stats(
+    values: np.ndarray, offsets: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Per-segment counts, means and sums of squared deviations for a
+    structure-of-arrays ``(values, offsets)`` pair, computed with single
+    vectorized passes over the whole array.
+    """
+    counts = np.diff(offsets)
+    sums = np.add.reduceat(values, offsets[:-1])
+    sums2 = np.add.reduceat(np.square(values), offsets[:-1])
+    means = sums / counts
+    return counts, means, sums2 - np.square(sums) / counts
+
+
+def batch_is_significant(
+    ref_stats, head_stats, ref_indices: np.ndarray, head_indices: np.ndarray
+) -> np.ndarray:
+    """
+    Vectorized version of ``pyperf._utils.is_significant`` (a Student's
+    two-sample, two-tailed t-test with alpha=0.95) over many benchmark
+    pairs at once.
+    """
+    ref_counts, ref_means, ref_ss = ref_stats
+    head_counts, head_means, head_ss = head_stats
+    deg_freedom = ref_counts[ref_indices] + head_counts[head_indices] - 2
+    pooled_variance = (ref_ss[ref_indices] + head_ss[head_indices]) / deg_freedom
+    t_scores = (ref_means[ref_indices] - head_means[head_indices]) / np.sqrt(
+        pooled_variance / ref_counts[ref_indices] * 2.0
+    )
+    critical = np.array([pyperf._utils.tdist95conf_level(df) for df in deg_freedom])
+    return np.abs(t_scores) >= critical
+
+
+def calculate_diffs(
+    ref_values, head_values, outlier_rejection=True, significant=None
+) -> tuple[Optional[np.ndarray], float]:
+    if significant is None:
+        significant, _ = pyperf._utils.is_significant(ref_values, head_values)
+
+    if not significant:
+        return None, 0.0
+    else:
+        if outlier_rejection:
+            ref_values = remove_outliers(ref_values)
+            head_values = remove_outliers(head_values)
+        # mean(outer(a, 1/b)) == mean(a) * mean(1/b), so the mean can be
+        # computed without materializing the full N×M outer product.  For the
+        # violin plot, a fixed-size sample of the ratios is plenty.
+        inverse_head = 1.0 / head_values
+        mean = float(ref_values.mean() * inverse_head.mean())
+        rng = np.random.default_rng(0)
+        values = (
+            ref_values[rng.choice(len(ref_values), 100)]
+            * inverse_head[rng.choice(len(inverse_head), 100)]
+        )
+        values.sort()
+        return values, mean
+
+
+_DIFF_FIGURE: Optional[Figure] = None
+
+
+def _reusable_figure(figsize: tuple[float, float]):
+    """
+    Reuse a single Figure (per process) for all of the diff plots.  Creating
+    a figure through pyplot costs tens of milliseconds, which adds up when
+    plot_diff runs for every comparison in the repository.
+    """
+    global _DIFF_FIGURE
+    if _DIFF_FIGURE is None:
+        _DIFF_FIGURE = Figure(layout="constrained")
+    else:
+        _DIFF_FIGURE.clear()
+    _DIFF_FIGURE.set_size_inches(*figsize)
+    return _DIFF_FIGURE, _DIFF_FIGURE.add_subplot()
+
+
+def plot_diff(
+    ref: result.Result, head: result.Result, output_filename: Path, title: str
+) -> None:
+    ref_names, ref_values, ref_offsets = get_data(ref)
+    head_names, head_values, head_offsets = get_data(head)
+    head_index = {name: i for i, name in enumerate(head_names)}
+
+    pairs = [
+        (name, i, head_index[name])
+        for i, name in enumerate(ref_names)
+        if name in head_index
+    ]
+
+    combined_data = []
+    if pairs:
+        # Run the significance tests for all benchmarks in one vectorized
+        # batch rather than one Python-level t-test per benchmark.
+        ref_indices = np.array([i for _, i, _ in pairs], dtype=np.intp)
+        head_indices = np.array([j for _, _, j in pairs], dtype=np.intp)
+        significant = batch_is_significant(
+            _segment_stats(ref_values, ref_offsets),
+            _segment_stats(head_values, head_offsets),
+            ref_indices,
+            head_indices,
+        )
+
+        for (name, i, j), sig in zip(pairs, significant):
+            combined_data.append(
+                (
+                    name,
+                    *calculate_diffs(
+                        ref_values[ref_offsets[i] : ref_offsets[i + 1]],
+                        head_values[head_offsets[j] : head_offsets[j + 1]],
+                        significant=bool(sig),
+                    ),
+                )
+            )
+    combined_data.sort(key=itemgetter(2))
+
+    if not any(values is not None for _, values, _ in combined_data):
+        # Nothing differs significantly, so don't render a full violin plot
+        # of placeholder rows.  A small text-only plot keeps the links to
+        # this file (and the file-exists skip) working.
+        fig, axs = _reusable_figure((8, 2))
+        axs.text(0.5, 0.5, "No significant changes", ha="center", va="center")
+        axs.set_axis_off()
+        axs.set_title(title)
+        fig.savefig(output_filename)
+        return
+
+    fig, axs = _reusable_figure((8, 2 + len(combined_data) * 0.3))
+    axs.axvline(1.0)
+    plot_diff_pair(axs, combined_data)
+    names = [x[0] for x in combined_data]
+    names.append("ALL")
+    axs.set_yticks(np.arange(len(names)) + 1, names)
+    axs.set_ylim(0, len(names) + 1)
+    axs.tick_params(axis="x", bottom=True, top=True, labelbottom=True, labeltop=True)
+    axs.xaxis.set_major_formatter(formatter)
+    axs.grid()
+    axs.set_title(title)
+
+    fig.savefig(output_filename)
+
+
+_MICRO_RE = re.compile(r"[0-9]+([a-z]+.+)")
+
+
+def get_micro_version(version):
+    micro = version.split(".")[-1].replace("+", "")
+    if match := _MICRO_RE.match(micro):
+        micro = match.groups()[0]
+    return micro
+
+
+@functools.lru_cache(maxsize=None)
+def _hpt_percentile_value(ref, r, base):
+    return result.BenchmarkComparison(ref, r, base).hpt_percentile_float(99)
+
+
+# TODO: Make this configurable
+def longitudinal_plot(
+    results: Iterable[result.Result],
+    output_filename: Path,
+    bases=["3.10.4", "3.11.0", "3.12.0"],
+    runners=["linux", "pythonperf2", "darwin", "pythonperf1", "pythonperf1_win32"],
+    names=["linux", "linux2", "macos", "win64", "win32"],
+    colors=["C0", "C0", "C2", "C3", "C3"],
+    styles=["-", ":", "-", "-", ":"],
+    versions=[(3, 11), (3, 12), (3, 13)],
+):
+    tier2_date = datetime.datetime.fromisoformat("2023-11-11T00:00:00Z")
+
+    def get_comparison_value(ref, r, base):
+        key = ",".join((ref.filename.name, r.filename.name, base))
+        if key in data:
+            return data[key]
+        else:
+            value = _hpt_percentile_value(ref, r, base)
+            data[key] = value
+            return value
+
+    if (output_filename.parent / "longitudinal.json").is_file():
+        with open(output_filename.parent / "longitudinal.json", "rb") as fd:
+            if orjson is not None:
+                data = orjson.loads(fd.read())
+            else:
+                data = json.load(fd)
+    else:
+        data = {}
+
+    fig, axs = plt.subplots(
+        len(versions), 1, figsize=(10, 5 * len(versions)), layout="constrained"
+    )
+
+    results = [r for r in results if r.fork == "python"]
+
+    for i, (version, base, ax) in enumerate(zip(versions, bases, axs)):
+        version_str = ".".join(str(x) for x in version)
+        ver_results = [r for r in results if r.parsed_version.release[0:2] == version]
+
+        ax.set_title(f"Python {version_str}.x vs. {base}")
+        ax.yaxis.set_major_formatter(formatter)
+        ax.grid()
+
+        for runner_i, (runner, name, color, style) in enumerate(
+            zip(runners, names, colors, styles)
+        ):
+            runner_results = [r for r in ver_results if r.nickname == runner]
+
+            # For 3.13, only use Tier 2 results after 2023-11-11
+            if version == (3, 13):
+                runner_results = [
+                    r
+                    for r in runner_results
+                    if not (r.parsed_commit_datetime > tier2_date and not r.is_tier2)
+                ]
+
+            for r in results:
+                if r.nickname == runner and r.version == base:
+                    ref = r
+                    break
+            else:
+                continue
+
+            runner_results.sort(key=attrgetter("commit_datetime"))
+            dates = [x.parsed_commit_datetime for x in runner_results]
+            changes = [get_comparison_value(ref, r, base) for r in runner_results]
+
+            ax.plot(
+                dates,
+                changes,
+                color=color,
+                linestyle=style,
+                markersize=2.5,
+                label=name,
+                alpha=0.9,
+                rasterized=len(dates) > 500,
+            )
+
+            if runner_i > 0:
+                continue
+
+            # Select the first occurrence of each micro version up front so
+            # the loop below only touches the handful of annotated results.
+            eligible = [
+                j for j, r in enumerate(runner_results) if not r.version.endswith("+")
+            ]
+            micros = [get_micro_version(runner_results[j].version) for j in eligible]
+            _, first_indices = np.unique(micros, return_index=True)
+            for pos in sorted(first_indices):
+                j = eligible[pos]
+                text = ax.annotate(
+                    micros[pos],
+                    xy=(dates[j], changes[j]),
+                    xycoords="data",
+                    xytext=(-3, 15),
+                    textcoords="offset points",
+                    rotation=90,
+                    arrowprops=dict(arrowstyle="-", connectionstyle="arc"),
+                )
+                text.set_color("#888")
+                text.set_size(8)
+                text.arrow_patch.set_color("#888")
+
+        ylim = ax.get_ylim()
+        ax.set_ylim(top=ylim[1] + 0.01)
+        ax.legend(loc="upper left")
+        ax.annotate(
+            "faster ⟶",
+            xy=(0.0, 1.0),
+            xycoords=("axes fraction", "data"),
+            xytext=(10, 10),
+            textcoords="offset pixels",
+            rotation=90,
+            clip_on=True,
+        )
+        ax.annotate(
+            "⟵ slower",
+            xy=(0.0, 1.0),
+            xycoords=("axes fraction", "data"),
+            xytext=(10, -10),
+            textcoords="offset pixels",
+            rotation=90,
+            clip_on=True,
+            verticalalignment="top",
+        )
+
+        # Add a line for when Tier 2 was turned on
+        if i == 2:
+            ax.axvline(tier2_date)
+            ax.annotate(
+                "TIER 2",
+                xy=(tier2_date, 0.9),
+                xycoords=("data", "axes fraction"),
+                xytext=(10, 0),
+                textcoords="offset pixels",
+                rotation=90,
+            )
+
+    fig.suptitle("Performance improvement by major version")
+
+    plt.savefig(output_filename, dpi=150)
+    plt.close()
+
+    with open(output_filename.parent / "longitudinal.json", "wb") as fd:
+        if orjson is not None:
+            fd.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        else:
+            fd.write(json.dumps(data, indent=2).encode("utf-8"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Compare two benchmark .json files")
+    parser.add_argument("ref", help="The reference .json file")
+    parser.add_argument("head", help="The head .json file")
+    parser.add_argument("output", help="Output filename")
+    parser.add_argument("title", help="Title of plot")
+    args = parser.parse_args()
+
+    plot_diff(
+        result.Result.from_filename(Path(args.ref)),
+        result.Result.from_filename(Path(args.head)),
+        Path(args.output),
+        args.title,
+    )
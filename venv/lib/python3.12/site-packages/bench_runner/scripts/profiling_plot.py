@@ -0,0 +1,600 @@
+"""
+Generate summary tables and a visualization of Linux perf profiling results.
+"""
+from __future__ import annotations
+
+
+import argparse
+import bisect
+from collections import defaultdict
+import concurrent.futures
+import csv
+import io
+import itertools
+from pathlib import Path
+import re
+import sys
+
+
+import matplotlib
+from matplotlib import pyplot as plt
+from matplotlib.collections import PolyCollection
+from matplotlib.patches import Patch
+import numpy as np
+
+
+matplotlib.use("agg")
+
+
+SANITY_CHECK = True
+
+
+# Categories of functions, where each value is a list of regular expressions.
+# These are matched in-order.
+CATEGORIES: dict[str, list[str]] = {
+    "interpreter": [
+        "_Py_GetBaseOpcode",
+        "_PyCode_Quicken",
+        "_PyCode_Validate",
+        "_PyEval.+",
+        "_PyFrame_ClearExceptCode",
+        "_PyFrame_New_NoTrack",
+        "_PyFrame_Traverse",
+        "_PyPegen_.+",
+        "_PyThreadState_PopFrame",
+        "advance",
+        "initialize_locals",
+        "intern_string_constants",
+        "PyAST_.+",
+        "PyEval_.+",
+    ],
+    "lookup": [
+        "_Py_dict_lookup",
+        "_Py_type_getattro",
+        "_PyType_Lookup",
+        "builtin_getattr",
+        "find_name_in_mro",
+        "lookdict_split",
+        "lookdict_unicode_nodummy",
+        "lookdict_unicode",
+        "PyMember_.*",
+        "unicodekeys_lookup_unicode",
+        "update_one_slot",
+    ],
+    "gc": [
+        "_?PyObject_GC_.+",
+        "_PyObject_Visit.+",
+        "_PyTrash_.+",
+        ".+_traverse",
+        ".+MaybeUntrack",
+        "gc_collect_main",
+        "PyObject_IS_GC",
+        "type_is_gc",
+        "visit_.+",
+    ],
+    "memory": [
+        "_?PyMem_.+",
+        "_Py_NewReference",
+        "_PyObject_Free",
+        "_PyObject_Malloc",
+        ".+_alloc",
+        ".+[Nn]ew.*",
+        ".+Alloc",
+        ".+Calloc",
+        ".+dealloc",
+        ".+Dealloc",
+        ".+Realloc",
+    ],
+    "dynamic": [
+        "_?PyMapping_.+",
+        "_?PyNumber_.+",
+        "_?PyObject_.+",
+        "_?PySequence_.+",
+        "_Py_type_getattro_impl",
+        "_PySuper_Lookup",
+        "_PyType_GetDict",
+        "delitem_common",
+        "do_super_lookup",
+        "getset_get",
+        "method_get",
+        "object_.+",
+        "PyDescr_.+",
+        "PyIter_.+",
+        "PyType_GetModuleByDef",
+        "PyType_IsSubtype",
+        "slot_tp_richcompare",
+        "StopIteration.+",
+        "type_.+",
+    ],
+    "library": ["_?sre_.+", "pattern_.+"],
+    "int": [
+        "_?PyLong_.+",
+        "Balloc",
+        "k_.+",
+        "l_.+",
+        "long_.+",
+        "x_.+",
+    ],
+    "tuple": [
+        "_?PyTuple_.+",
+        "tuple.+",
+    ],
+    "dict": [
+        "_?PyDict_.+",
+        "build_indices_unicode",
+        "clone_combined_dict_keys.+",
+        "dict_.+",
+        "dictiter_.+",
+        "dictresize",
+        "find_empty_slot",
+        "free_keys_object",
+        "insert_to_emptydict",
+        "insertdict",
+        "new_keys_object",
+        "OrderedDict_.+",
+    ],
+    "list": [
+        "_?PyList_.+",
+        "list_.+",
+        "listiter_.+",
+    ],
+    "float": [
+        "_?PyFloat_.+",
+        "float_.+",
+    ],
+    "str": [
+        "_?PyUnicode.+",
+        "_copy_characters.+",
+        "ascii_decode",
+        "bytes_.+",
+        "PyBytes_.+",
+        "replace",
+        "resize_compact",
+        "siphash13",
+        "split",
+        "stringlib_.+",
+        "unicode_.+",
+    ],
+    "miscobj": [
+        "_?PySlice_.+",
+        "_PyBuildSlice_ConsumeRefs",
+        "_PyEval_SliceIndex",
+        "bytearray_.+",
+        "deque_.+",
+        "dequeiter_.+",
+        "enum_.+",
+        "PyBool_.+",
+        "PyBuffer_.+",
+        "set_.+",
+        "setiter_.+",
+    ],
+    "exceptions": [
+        "_?PyErr_.*",
+        ".+Error_init",
+        "BaseException.*",
+        "PyCode_Addr2Line",
+        "PyException_.*",
+        "PyFrame_.*",
+        "PyTraceBack_.+",
+    ],
+    "gil": [
+        "drop_gil",
+        "PyGILState_.*",
+        "take_gil",
+    ],
+    "calls": [
+        "_?PyArg_.+",
+        "_Py_CheckFunctionResult",
+        "_PyFunction_Vectorcall",
+        "cfunction_call.*",
+        "cfunction_vectorcall.+",
+        "method_vectorcall.+",
+        "vectorcall_method",
+        "vgetargs1_impl",
+        "vgetargskeywords.constprop.0",
+    ],
+    "import": [
+        "PyImport.+",
+        "r_.+",
+    ],
+}
+
+
+def _fuse_categories(categories: dict[str, list[str]]) -> re.Pattern:
+    """
+    Fuse a set of categories into a single master pattern, with one named
+    alternative per category.  The category that matched is reported through
+    ``lastgroup``, and the alternation order preserves the original in-order,
+    first-category-wins semantics.  The alternatives are unanchored; callers
+    use ``fullmatch``, which anchors once for the whole pattern.
+    """
+    return re.compile(
+        "|".join(
+            f"(?P<{category}>" + "|".join(f"(?:{p})" for p in patterns) + ")"
+            for category, patterns in categories.items()
+        )
+    )
+
+
+def _leading_literals(pattern: str) -> list[str]:
+    """
+    The literal string(s) any match of ``pattern`` must start with.  A
+    leading ``_?`` expands to both variants; the literal stops at the first
+    metacharacter (or just before one that quantifies the previous
+    character).
+    """
+    prefixes = [""]
+    i = 0
+    if pattern.startswith("_?"):
+        prefixes = ["_", ""]
+        i = 2
+
+    literal = ""
+    while i < len(pattern) and pattern[i] not in ".+*?[](){}\\|^$":
+        if i + 1 < len(pattern) and pattern[i + 1] in "+*?{":
+            break
+        literal += pattern[i]
+        i += 1
+
+    return [prefix + literal for prefix in prefixes]
+
+
+_PREFIX_LEN = 4
+
+
+def _build_prefix_dispatch() -> tuple[dict[str, re.Pattern], re.Pattern]:
+    """
+    Bucket the category patterns by the first few literal characters any of
+    their matches must start with.  Classifying a symbol head then only
+    runs the small fused pattern for its prefix (or the universal patterns
+    when no bucket applies) instead of the whole master alternation.
+    """
+    universal: dict[str, list[str]] = defaultdict(list)
+    by_prefix: dict[str, dict[str, list[str]]] = defaultdict(lambda: defaultdict(list))
+
+    for category, patterns in CATEGORIES.items():
+        for pattern in patterns:
+            literals = _leading_literals(pattern)
+            if all(len(literal) >= _PREFIX_LEN for literal in literals):
+                for literal in literals:
+                    by_prefix[literal[:_PREFIX_LEN]][category].append(pattern)
+            else:
+                universal[category].append(pattern)
+
+    dispatch = {}
+    for prefix, specific in by_prefix.items():
+        # The universal patterns may match anything, and earlier categories
+        # take precedence, so each bucket re-fuses both sets of patterns in
+        # the original category order.
+        merged = {
+            category: [*specific.get(category, []), *universal.get(category, [])]
+            for category in CATEGORIES
+            if category in specific or category in universal
+        }
+        dispatch[prefix] = _fuse_categories(merged)
+
+    return dispatch, _fuse_categories(universal)
+
+
+_PREFIX_DISPATCH, _UNIVERSAL_RE = _build_prefix_dispatch()
+
+
+_SO_RE = re.compile(r".\.so(\..+)?$")
+
+
+_CATEGORY_CACHE: dict[tuple[str, str], str] = {}
+
+
+def category_for_obj_sym(obj: str, sym: str) -> str:
+    # An inline dict with interned keys beats the functools.cache wrapper
+    # for a classifier this hot: no wrapper call, and tuple hashing over
+    # interned strings is effectively an identity hash.  Keying on the
+    # symbol's head rather than the full symbol folds the many "+0x..."
+    # offset variants of one function into a single cache entry.
+    key = (sys.intern(obj), sys.intern(sym.partition(" ")[0]))
+    category = _CATEGORY_CACHE.get(key)
+    if category is None:
+        category = _CATEGORY_CACHE[key] = _classify(*key)
+    return category
+
+
+def _classify(obj: str, head: str) -> str:
+    if obj == "[kernel.kallsyms]":
+        return "kernel"
+
+    if obj.startswith("libc"):
+        return "libc"
+
+    # The cheap substring test filters out almost every non-library object
+    # before the regex runs at all.
+    if ".so" in obj and _SO_RE.search(obj):
+        return "library"
+
+    if obj == "python":
+        m = _PREFIX_DISPATCH.get(head[:_PREFIX_LEN], _UNIVERSAL_RE).fullmatch(head)
+        if m is not None:
+            return m.lastgroup
+
+    return "unknown"
+
+
+def _read_rows(csv_path: Path) -> list[tuple[str, str, float]]:
+    """
+    Read a perf CSV and return its (obj, sym, self_time) rows, with the
+    percentage conversion done as one vectorized pass instead of a float()
+    call per row.
+    """
+    # A large binary buffer amortizes read syscalls, and the unix dialect
+    # keeps the C csv parser's quoting state machine simple.
+    with open(csv_path, "rb", buffering=1 << 20) as raw, io.TextIOWrapper(
+        raw, encoding="utf-8", newline=""
+    ) as fd:
+        csvreader = csv.reader(fd, csv.unix_dialect)
+        next(csvreader, None)  # skip the header
+
+        # python3.8 is the "parent" python orchestrating pyperformance
+        rows = [row for row in csvreader if row[2] != "python3.8"]
+
+    if not len(rows):
+        return []
+
+    self_times = np.array([row[0] for row in rows], dtype=np.float64) / 100.0
+
+    # The rows are sorted by self time, so stop at the first non-positive one
+    nonpositive = np.nonzero(self_times <= 0.0)[0]
+    cutoff = nonpositive[0] if len(nonpositive) else len(rows)
+
+    return [
+        (row[2], row[3], self_time)
+        for row, self_time in zip(rows[:cutoff], self_times[:cutoff])
+    ]
+
+
+def _main(input_dir: Path, output_prefix: Path):
+    results = defaultdict(lambda: defaultdict(float))
+
+    if not input_dir.exists() or len(list(input_dir.glob("*.csv"))) == 0:
+        print("No profiling data. Skipping.")
+        return
+
+    csv_paths = sorted(input_dir.glob("*.csv"))
+
+    # Each CSV parses independently, so spread the ingestion across cores;
+    # executor.map preserves the sorted input order.
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        files = [
+            (csv_path.stem.split(".", 1)[0], rows)
+            for csv_path, rows in zip(csv_paths, executor.map(_read_rows, csv_paths))
+        ]
+
+    # Classify each distinct (obj, sym) pair exactly once, no matter how many
+    # rows and files it appears in.
+    unique_pairs = {(obj, sym) for _, rows in files for obj, sym, _ in rows}
+    pair_category = {pair: category_for_obj_sym(*pair) for pair in unique_pairs}
+
+    # Encode the pairs and categories as integer codes so all of the
+    # aggregation happens in vectorized bincount reductions rather than a
+    # pair of dict updates per row.
+    pair_list = list(pair_category)
+    pair_index = {pair: i for i, pair in enumerate(pair_list)}
+    category_list = list(dict.fromkeys(pair_category.values()))
+    category_index = {category: i for i, category in enumerate(category_list)}
+    pair_cat_codes = np.fromiter(
+        (category_index[pair_category[pair]] for pair in pair_list),
+        np.intp,
+        len(pair_list),
+    )
+    pair_totals = np.zeros(len(pair_list), dtype=np.float64)
+
+    with open(output_prefix.with_suffix(".md"), "w") as md:
+        for stem, rows in files:
+            # Buffer each section and write it with a single call, rather
+            # than hitting the file object once per row.
+            chunks = [
+                f"\n## {stem}\n\n",
+                "| percentage | object | symbol | category |\n",
+                "| ---: | :--- | :--- | :--- |\n",
+            ]
+            # The rows are sorted by self time, so the displayable subset is
+            # a prefix found by bisection rather than a test per row.
+            display_end = bisect.bisect_right(rows, -0.005, key=lambda row: -row[2])
+            chunks.extend(
+                f"| {self_time:.2%} | `{obj}` | `{sym}` "
+                f"| {pair_category[(obj, sym)]} |\n"
+                for obj, sym, self_time in rows[:display_end]
+            )
+            md.write("".join(chunks))
+
+            codes = np.fromiter(
+                (pair_index[(obj, sym)] for obj, sym, _ in rows), np.intp, len(rows)
+            )
+            times = np.fromiter((t for _, _, t in rows), np.float64, len(rows))
+            file_pair_totals = np.bincount(
+                codes, weights=times, minlength=len(pair_list)
+            )
+            pair_totals += file_pair_totals
+
+            file_cat_totals = np.bincount(
+                pair_cat_codes, weights=file_pair_totals, minlength=len(category_list)
+            )
+            for category, total in zip(category_list, file_cat_totals):
+                if total:
+                    results[stem][category] += total
+
+        # A flat dict keyed by (category, obj, sym) costs one hash lookup per
+        # update instead of the two (plus the inner dict allocation) of a
+        # nested defaultdict, with the per-category totals accumulated in the
+        # same pass.
+        flat: dict[tuple[str, str, str], float] = {}
+        category_totals: dict[str, float] = {}
+        for (obj, sym), total in zip(pair_list, pair_totals):
+            if total:
+                category = pair_category[(obj, sym)]
+                key = (category, obj, sym)
+                flat[key] = flat.get(key, 0.0) + total
+                category_totals[category] = (
+                    category_totals.get(category, 0.0) + total
+                )
+
+        n_files = len(results)
+
+        sorted_categories = sorted(
+            [
+                (total / n_files, category)
+                for (category, total) in category_totals.items()
+            ],
+            reverse=True,
+        )
+
+        # The per-category listings are only needed here, so group the flat
+        # entries back by category just before emission, dropping the rows
+        # below the display threshold so only the visible few get sorted and
+        # formatted.
+        by_category = defaultdict(list)
+        for (category, obj, sym), self_time in flat.items():
+            if self_time >= 0.005:
+                by_category[category].append((self_time, obj, sym))
+
+        chunks = ["\n\n## Categories\n"]
+        for total, category in sorted_categories:
+            chunks.append(f"\n### {category}\n\n")
+            chunks.append(f"{total:.2%} total\n\n")
+            chunks.append("| percentage | object | symbol |\n")
+            chunks.append("| ---: | :--- | :--- |\n")
+            for self_time, obj, sym in sorted(by_category[category], reverse=True):
+                chunks.append(f"| {self_time / n_files:.2%} | {obj} | {sym} |\n")
+        md.write("".join(chunks))
+
+    fig, ax = plt.subplots(figsize=(8, n_files * 0.3), layout="constrained")
+
+    bottom = np.zeros(n_files)
+    names = list(results)[::-1]
+
+    # One contiguous (file, category) matrix of totals, so each bar below is
+    # a column slice rather than a fresh per-category comprehension.
+    matrix = np.zeros((n_files, len(category_list)), dtype=np.float64)
+    for row, name in enumerate(names):
+        for category, total in results[name].items():
+            matrix[row, category_index[category]] = total
+
+    hatches = ["", "//", "\\\\"]
+    drawn = [
+        (i, val, category)
+        for i, (val, category) in enumerate(sorted_categories)
+        if category != "unknown"
+    ]
+
+    # One artist per hatch group instead of one barh call per category: each
+    # rectangle is a quad in a PolyCollection, with per-quad facecolors.
+    cols = matrix[:, [category_index[category] for _, _, category in drawn]]
+    lefts = np.zeros_like(cols)
+    np.cumsum(cols[:, :-1], axis=1, out=lefts[:, 1:])
+    rights = lefts + cols
+    ys = np.arange(n_files, dtype=np.float64)
+
+    # Group by the sorted-category index, not the position in drawn, so each
+    # collection's hatch matches the legend's hatches[i // 10] even with
+    # "unknown" filtered out of the middle of the order.
+    for hatch_index, members in itertools.groupby(
+        enumerate(drawn), key=lambda member: member[1][0] // 10
+    ):
+        members = list(members)
+        group = [pos for pos, _ in members]
+        x0 = lefts[:, group]
+        x1 = rights[:, group]
+        y0 = np.broadcast_to((ys - 0.25)[:, np.newaxis], x0.shape)
+        y1 = np.broadcast_to((ys + 0.25)[:, np.newaxis], x0.shape)
+        verts = np.stack(
+            [
+                np.stack([x0, y0], axis=-1),
+                np.stack([x1, y0], axis=-1),
+                np.stack([x1, y1], axis=-1),
+                np.stack([x0, y1], axis=-1),
+            ],
+            axis=-2,
+        ).reshape(-1, 4, 2)
+        facecolors = [f"C{i%10}" for _, (i, _, _) in members] * n_files
+        ax.add_collection(
+            PolyCollection(
+                verts, facecolors=facecolors, hatch=hatches[hatch_index]
+            )
+        )
+
+    bottom = rights[:, -1] if len(drawn) else bottom
+    ax.barh(ys, 1.0 - bottom, 0.5, left=bottom, color="#ddd")
+    ax.set_yticks(ys, names)
+
+    handles = [
+        Patch(
+            facecolor=f"C{i%10}",
+            hatch=hatches[i // 10],
+            label=f"{category} {val:.2%}",
+        )
+        for i, val, category in drawn
+    ]
+    handles.append(Patch(facecolor="#ddd", label="(other functions)"))
+
+    ax.set_xlabel("percentage time")
+    ax.legend(handles=handles, bbox_to_anchor=(1.05, 1.0), loc="upper left")
+    ax.set_xlim([0, 1])
+    ax.set_ylim([-0.5, n_files - 0.5])
+
+    bar_fig = fig
+
+    fig, ax = plt.subplots(figsize=(5, 3), layout="constrained")
+    values = [x[0] for x in sorted_categories]
+    labels = [
+        i < 10 and f"{x[1]} {x[0]:.2%}" or "" for i, x in enumerate(sorted_categories)
+    ]
+    colors = [f"C{i%10}" for i in range(len(values))]
+    hatches = [hatches[i // 10] for i in range(len(values))]
+
+    other = 1.0 - sum(values)
+    values.append(other)
+    labels.append("")
+    colors.append("#ddd")
+    hatches.append("")
+
+    ax.pie(
+        values, labels=labels, colors=colors, hatch=hatches, textprops={"fontsize": 6}
+    )
+
+    # With the agg backend, the PNG encoding releases the GIL inside
+    # libpng/zlib, so the two fully-built figures can be saved in parallel.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(bar_fig.savefig, output_prefix.with_suffix(".png")),
+            executor.submit(
+                fig.savefig, output_prefix.with_suffix(".pie.png"), dpi=200
+            ),
+        ]
+        for future in futures:
+            future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "Generate graphs from profiling information",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "input_dir",
+        type=Path,
+        default=Path(),
+        help="The location of the .csv files of profiling data",
+    )
+    parser.add_argument(
+        "output",
+        type=Path,
+        default=Path(),
+        help="The path and file prefix for the output files",
+    )
+
+    args = parser.parse_args()
+
+    _main(args.input_dir, args.output)
+
+
+if __name__ == "__main__":
+    main()
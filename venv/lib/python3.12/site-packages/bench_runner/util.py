@@ -0,0 +1,9 @@
+def status(char: str) -> None:
+    # Don't flush on every character: with thousands of results each flush
+    # is a syscall.  The loops that emit status characters end with a
+    # print(), whose newline flushes line-buffered output.
+    print(char, end="")
+
+
+TIER2_FLAGS = ["PYTHON_UOPS"]
+JIT_FLAGS = ["JIT"]